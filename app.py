@@ -1,16 +1,41 @@
-from flask import Flask, jsonify, render_template, request, redirect, url_for, flash
+from flask import Flask, abort, g, jsonify, render_template, stream_template, request, redirect, send_file, session, url_for, flash
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, login_user, logout_user, current_user, login_required
 from flask_admin import Admin, AdminIndexView
 from flask_admin.contrib.sqla import ModelView
 from flask_migrate import Migrate
 from werkzeug.security import check_password_hash, generate_password_hash
+from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.utils import secure_filename
+import click
 from datetime import datetime, date, timedelta
+import io
+import gzip
+import hashlib
+import heapq
+import json
 import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import textwrap
+import threading
+import time
+import uuid
+import zlib
+
+try:
+    import brotli  # opcional: pip install brotli
+except ImportError:
+    brotli = None
+
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy import create_engine, tuple_
+from sqlalchemy.orm import Session, joinedload, selectinload
 
 # Modelos
-from models import Cliente, LogPedido, Pedido, PedidoQR, db, Item, Imagem, CategoriaDestaque, Reserva, Usuario
+from models import TABELAS_GLOBAIS, Cliente, DisponibilidadeAlteracao, DisponibilidadeVersao, LogPedido, Pedido, PedidoArquivado, PedidoQR, db, Item, Imagem, CategoriaDestaque, Reserva, ReservaArquivada, Usuario
 
 # App e configurações
 app = Flask(__name__)
@@ -18,9 +43,58 @@ app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///database.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.secret_key = 'sua_chave_secreta_aqui'
 
+# Lojas (filiais): cada uma com seu próprio arquivo de banco, ex.: LOJAS=centro,shopping.
+# Sem lojas configuradas o app funciona como antes, só com database.db.
+app.config['LOJAS'] = [l.strip() for l in os.environ.get('LOJAS', '').split(',') if l.strip()]
+app.config['SQLALCHEMY_BINDS'] = {loja: f'sqlite:///loja_{loja}.db' for loja in app.config['LOJAS']}
+# Loja pelo subdomínio (centro.<LOJA_DOMINIO>) ou pelo prefixo do caminho (/loja/centro/...)
+app.config['LOJA_DOMINIO'] = os.environ.get('LOJA_DOMINIO')
+
 # Upload de imagens
 app.config['UPLOAD_FOLDER'] = os.path.join(app.root_path,'static', 'images')
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+# Limite total de cada requisição (formulários com várias fotos incluídos)
+app.config['MAX_CONTENT_LENGTH'] = 32 * 1024 * 1024
+app.config['QRCODE_FOLDER'] = os.path.join(app.root_path, 'static', 'qrcodes')
+# Imagens do próprio site em static/images que não pertencem a nenhum item
+app.config['UPLOADS_PROTEGIDOS'] = {'default.jpg', 'banner.png', 'logomaniquimf.png', 'logomaniquimh.png', 'logomaniquimv.png', 'sobre.jpg'}
+
+# Upload de imagens em partes (retomável)
+app.config['UPLOAD_PARTES_DIR'] = os.path.join(app.instance_path, 'uploads')
+app.config['UPLOAD_TAMANHO_PARTE'] = 1024 * 1024
+app.config['UPLOAD_TAMANHO_MAXIMO'] = 50 * 1024 * 1024  # por arquivo
+
+# Limite de reservas públicas: (capacidade do balde, segundos para recarregá-lo por completo)
+app.config['RESERVA_LIMITE_IP'] = (10, 60)
+app.config['RESERVA_LIMITE_TELEFONE'] = (3, 3600)
+# Quantos proxies (roteador do Heroku, nginx...) ficam na frente do gunicorn e são confiáveis.
+# Com 0 o IP do limite é o do socket; atrás de proxy, use 1 (ou mais), senão todos os
+# visitantes dividem o IP do proxy e o limite por IP vira um limite do site inteiro.
+app.config['PROXIES_CONFIAVEIS'] = int(os.environ.get('PROXIES_CONFIAVEIS', '0'))
+# 'memoria' (por worker) ou 'sqlite' (compartilhado entre os workers do gunicorn)
+app.config['RESERVA_LIMITE_BACKEND'] = os.environ.get('RESERVA_LIMITE_BACKEND', 'memoria')
+app.config['RESERVA_LIMITE_ARQUIVO'] = os.path.join(app.instance_path, 'limites.db')
+
+# Listas grandes (produtos/categoria) renderizadas em streaming, item a item
+app.config['STREAM_LISTAS'] = os.environ.get('STREAM_LISTAS') == '1'
+# Cache em disco dos templates já compilados pelo Jinja (compartilhado entre os workers)
+app.config['TEMPLATES_CACHE_DIR'] = os.path.join(app.instance_path, 'jinja_cache')
+os.makedirs(app.config['TEMPLATES_CACHE_DIR'], exist_ok=True)
+app.jinja_options = {**app.jinja_options, 'bytecode_cache': FileSystemBytecodeCache(app.config['TEMPLATES_CACHE_DIR'])}
+
+# Arquivamento: pedidos e reservas com evento há mais de N dias saem das tabelas principais
+app.config['ARQUIVO_DIAS'] = 180
+app.config['ARQUIVO_LOTE'] = 500
+
+# Backup do banco: cópias .db.gz com data/hora, mantendo só as mais recentes
+app.config['BACKUP_DIR'] = os.path.join(app.instance_path, 'backups')
+app.config['BACKUP_MANTER'] = 14
+app.config['BACKUP_PAGINAS_POR_PASSO'] = 256  # páginas copiadas por vez antes de liberar o banco
+app.config['BACKUP_TEMPO_MAXIMO'] = 3600  # segundos; passado isso, um backup "em andamento" é tido como abandonado
+
+# Compressão das respostas: tamanho mínimo em bytes e tipos comprimíveis
+app.config['COMPRESSAO_MINIMO'] = 1024
+app.config['COMPRESSAO_TIPOS'] = {'text/html', 'text/css', 'text/plain', 'application/json', 'application/javascript'}
 
 # Inicializa banco e migração
 db.init_app(app)
@@ -28,6 +102,83 @@ migrate = Migrate(app, db)
 
 with app.app_context():
     db.create_all()
+    # Banco de cada loja: mesmas tabelas, menos as globais (usuários ficam no principal)
+    tabelas_loja = [t for t in db.metadata.sorted_tables if t.name not in TABELAS_GLOBAIS]
+    for loja in app.config['LOJAS']:
+        db.metadata.create_all(db.engines[loja], tables=tabelas_loja)
+
+
+# 🏬 Lojas
+class LojaMiddleware:
+    """Descobre a loja pelo subdomínio ou por /loja/<slug>; o prefixo vai para o SCRIPT_NAME,
+    assim as rotas não mudam e o url_for já gera os links da loja certa."""
+
+    def __init__(self, wsgi_app, lojas, dominio=None):
+        self.wsgi_app = wsgi_app
+        self.lojas = set(lojas)
+        self.dominio = dominio
+
+    def __call__(self, environ, start_response):
+        loja = None
+        partes = environ.get('PATH_INFO', '').split('/', 3)
+        if len(partes) >= 3 and partes[1] == 'loja' and partes[2] in self.lojas:
+            loja = partes[2]
+            environ['SCRIPT_NAME'] = environ.get('SCRIPT_NAME', '') + f'/loja/{loja}'
+            environ['PATH_INFO'] = '/' + (partes[3] if len(partes) > 3 else '')
+        elif self.dominio:
+            host = environ.get('HTTP_HOST', '').split(':')[0]
+            subdominio = host[:-len(self.dominio) - 1] if host.endswith('.' + self.dominio) else None
+            if subdominio in self.lojas:
+                loja = subdominio
+        environ['manequim.loja'] = loja
+        return self.wsgi_app(environ, start_response)
+
+if app.config['LOJAS']:
+    app.wsgi_app = LojaMiddleware(app.wsgi_app, app.config['LOJAS'], app.config['LOJA_DOMINIO'])
+
+# Por fora de tudo: o remote_addr passa a ser o IP do visitante informado pelo proxy
+if app.config['PROXIES_CONFIAVEIS']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXIES_CONFIAVEIS'])
+
+@app.before_request
+def definir_loja():
+    g.loja = request.environ.get('manequim.loja')
+
+def todas_as_lojas():
+    # None = banco principal (database.db)
+    return [None] + app.config['LOJAS']
+
+def usar_loja(loja):
+    """Troca o banco da sessão fora de requisições (comandos de linha de comando)."""
+    db.session.remove()
+    g.loja = loja
+
+def engine_da_loja(loja=None):
+    return db.engines[loja] if loja else db.engine
+
+def pasta_uploads():
+    if g.get('loja'):
+        return os.path.join(app.config['UPLOAD_FOLDER'], g.loja)
+    return app.config['UPLOAD_FOLDER']
+
+def pasta_qrcodes():
+    if g.get('loja'):
+        return os.path.join(app.config['QRCODE_FOLDER'], g.loja)
+    return app.config['QRCODE_FOLDER']
+
+def caminho_qrcode(pedido_id):
+    # Caminho gravado em PedidoQR.qr_code_path, relativo à raiz do app
+    prefixo = f'static/qrcodes/{g.loja}/' if g.get('loja') else 'static/qrcodes/'
+    return f'{prefixo}pedido_{pedido_id}.png'
+
+@app.context_processor
+def inject_loja():
+    loja = g.get('loja')
+    return {
+        'loja': loja,
+        'pasta_imagens': f'images/{loja}/' if loja else 'images/',
+        'pasta_qrcodes': f'qrcodes/{loja}/' if loja else 'qrcodes/'
+    }
 
 # Login
 login_manager = LoginManager()
@@ -43,6 +194,124 @@ def load_user(user_id):
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in {'jpg', 'jpeg', 'png', 'gif'}
 
+def _agrupar(partes, tamanho=8192):
+    """Junta os pedaços pequenos gerados pelo Jinja em blocos de ~8 KB."""
+    buffer = []
+    acumulado = 0
+    for parte in partes:
+        buffer.append(parte)
+        acumulado += len(parte)
+        if acumulado >= tamanho:
+            # str.join comum: o Jinja pode entregar Markup, cujo join escaparia o HTML
+            yield (b'' if isinstance(parte, bytes) else '').join(buffer)
+            buffer, acumulado = [], 0
+    if buffer:
+        yield (b'' if isinstance(buffer[0], bytes) else '').join(buffer)
+
+def renderizar_lista(template, query, lote=50, **contexto):
+    """Renderiza uma listagem de itens (ordem: nome), em streaming se STREAM_LISTAS estiver ativo."""
+    query = query.options(selectinload(Item.imagens)).order_by(Item.nome, Item.id)
+    if app.config['STREAM_LISTAS']:
+        # Cada lote é uma consulta curta (paginação por nome/id) lida por inteiro: nenhum
+        # cursor fica aberto enquanto o HTML é enviado, então as escritas não esperam o cliente
+        def gerar_itens():
+            ultimo = None
+            while True:
+                consulta = query if ultimo is None else query.filter(tuple_(Item.nome, Item.id) > ultimo)
+                itens = consulta.limit(lote).all()
+                yield from itens
+                if len(itens) < lote:
+                    break
+                ultimo = (itens[-1].nome, itens[-1].id)
+        html = _agrupar(stream_template(template, itens=gerar_itens(), **contexto))
+        return app.response_class(html, mimetype='text/html')
+    return render_template(template, itens=query.all(), **contexto)
+
+
+# ⚡ Pré-compilação dos templates
+def aquecer_templates():
+    """Carrega todos os templates .html no cache do Jinja e retorna o tempo (ms) de cada um."""
+    tempos = {}
+    for nome in app.jinja_env.list_templates(filter_func=lambda n: n.endswith('.html')):
+        inicio = time.perf_counter()
+        app.jinja_env.get_template(nome)
+        tempos[nome] = (time.perf_counter() - inicio) * 1000
+    return tempos
+
+@app.cli.command('precompilar-templates')
+def precompilar_templates():
+    """Compila todos os templates para o cache em disco (rodar no deploy)."""
+    # Frio: sem cache em memória nem em disco, o Jinja compila a partir do fonte
+    app.jinja_env.bytecode_cache.clear()
+    app.jinja_env.cache.clear()
+    frio = aquecer_templates()
+
+    # Quente: o que um worker novo faz ao subir, lendo o bytecode do disco
+    app.jinja_env.cache.clear()
+    quente = aquecer_templates()
+
+    print(f'{"template":<30} {"frio (ms)":>10} {"quente (ms)":>12}')
+    for nome in sorted(frio):
+        print(f'{nome:<30} {frio[nome]:>10.2f} {quente[nome]:>12.2f}')
+    print(f'{"total":<30} {sum(frio.values()):>10.2f} {sum(quente.values()):>12.2f}')
+    print(f'{len(frio)} templates compilados em {app.config["TEMPLATES_CACHE_DIR"]}')
+
+
+# 🗜️ Compressão gzip/brotli das respostas
+def _codificacao_aceita():
+    opcoes = ['br', 'gzip'] if brotli else ['gzip']
+    return request.accept_encodings.best_match(opcoes)
+
+def _comprimir_stream(partes, codificacao):
+    if codificacao == 'br':
+        compressor = brotli.Compressor()
+        for parte in _agrupar(partes):
+            dados = compressor.process(parte) + compressor.flush()
+            if dados:
+                yield dados
+        yield compressor.finish()
+    else:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # 31 = formato gzip
+        for parte in _agrupar(partes):
+            # Z_SYNC_FLUSH manda cada bloco ao navegador sem esperar o fim da página
+            dados = compressor.compress(parte) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if dados:
+                yield dados
+        yield compressor.flush()
+
+@app.after_request
+def comprimir_resposta(response):
+    if (response.status_code != 200
+            or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in app.config['COMPRESSAO_TIPOS']):
+        return response
+
+    codificacao = _codificacao_aceita()
+    if not codificacao:
+        return response
+
+    if response.is_streamed:
+        response.response = _comprimir_stream(response.iter_encoded(), codificacao)
+        response.headers.pop('Content-Length', None)
+    else:
+        dados = response.get_data()
+        if len(dados) < app.config['COMPRESSAO_MINIMO']:
+            return response
+        if codificacao == 'br':
+            response.set_data(brotli.compress(dados))
+        else:
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+            response.set_data(compressor.compress(dados) + compressor.flush())
+
+    response.headers['Content-Encoding'] = codificacao
+    response.vary.add('Accept-Encoding')
+    # O corpo comprimido não é idêntico byte a byte ao original: o ETag passa a ser fraco
+    etag, _ = response.get_etag()
+    if etag:
+        response.set_etag(etag, weak=True)
+    return response
+
 # 🏠 Página inicial
 @app.route('/')
 def index():
@@ -64,15 +333,19 @@ def painel():
         'disponíveis': Item.query.filter_by(disponivel=True).count(),
         'indisponíveis': Item.query.filter_by(disponivel=False).count()
     }
-    reservas_por_mes = db.session.query(
-        db.func.strftime('%m/%Y', Reserva.data_evento),
-        db.func.count(Reserva.id)
-    ).group_by(db.func.strftime('%m/%Y', Reserva.data_evento)).all()
+    # Soma reservas ativas e arquivadas
+    todas_reservas = db.union_all(
+        db.select(Reserva.data_evento),
+        db.select(ReservaArquivada.data_evento)
+    ).subquery()
+    mes_reserva = db.func.strftime('%m/%Y', todas_reservas.c.data_evento)
+    reservas_por_mes = db.session.query(mes_reserva, db.func.count()).group_by(mes_reserva).all()
 
     return render_template('painel.html',
         categorias=categorias,
         disponibilidade=disponibilidade,
-        reservas_por_mes=reservas_por_mes
+        reservas_por_mes=reservas_por_mes,
+        estado_backup=ler_estado_backup(g.loja)
     )
 
 @app.route('/cadastrar-usuario', methods=['GET', 'POST'])
@@ -163,6 +436,10 @@ def ver_cliente(cliente_id):
         pedidos_query = pedidos_query.filter_by(cancelado=True)
 
     pedidos = pedidos_query.order_by(Pedido.data_evento.asc()).all()
+    if not status:
+        # Histórico completo: inclui os pedidos já arquivados
+        arquivados = PedidoArquivado.query.filter_by(cliente_id=cliente.id).all()
+        pedidos = sorted(pedidos + arquivados, key=lambda p: p.data_evento)
     return render_template('ver_cliente.html', cliente=cliente, pedidos=pedidos, status=status)
 
 @app.route('/cliente/<int:cliente_id>/editar', methods=['GET', 'POST'])
@@ -187,7 +464,9 @@ def editar_cliente(cliente_id):
 @login_required
 def pedidos_do_cliente(cliente_id):
     cliente = Cliente.query.get_or_404(cliente_id)
-    pedidos = Pedido.query.filter_by(cliente_id=cliente.id).order_by(Pedido.data_evento.desc()).all()
+    pedidos = Pedido.query.filter_by(cliente_id=cliente.id).all()
+    pedidos += PedidoArquivado.query.filter_by(cliente_id=cliente.id).all()
+    pedidos.sort(key=lambda p: p.data_evento, reverse=True)
     return render_template('pedidos_do_cliente.html', cliente=cliente, pedidos=pedidos)
 
 # 🔐 Autenticação
@@ -199,7 +478,7 @@ def login():
         usuario = Usuario.query.filter_by(email=email).first()
         if usuario and check_password_hash(usuario.senha, senha):
             login_user(usuario)
-            return redirect('/painel')
+            return redirect(url_for('painel'))
         else:
             flash('Credenciais inválidas')
     return render_template('login.html')
@@ -230,14 +509,19 @@ def cadastrar():
         for i, imagem in enumerate(imagens):
             if imagem and imagem.filename != '' and allowed_file(imagem.filename):
                 filename = secure_filename(imagem.filename)
-                os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-                caminho = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+                os.makedirs(pasta_uploads(), exist_ok=True)
+                caminho = os.path.join(pasta_uploads(), filename)
                 imagem.save(caminho)
                 nomes_salvos.append(filename)
 
                 if i == 0:
                     imagem_principal = filename
 
+        for filename in imagens_enviadas_validas():
+            if not nomes_salvos:
+                imagem_principal = filename
+            nomes_salvos.append(filename)
+
         novo_item = Item(
             nome=nome,
             modelo=modelo,
@@ -260,6 +544,155 @@ def cadastrar():
 
     return render_template('cadastrar.html', agora=agora)
 
+# 📤 Upload de imagens em partes
+def _pasta_upload(upload_id):
+    try:
+        upload_id = uuid.UUID(upload_id).hex
+    except ValueError:
+        abort(404)
+    pasta = os.path.join(app.config['UPLOAD_PARTES_DIR'], upload_id)
+    if not os.path.isdir(pasta):
+        abort(404)
+    return pasta
+
+def _ler_meta(pasta):
+    with open(os.path.join(pasta, 'meta.json')) as f:
+        return json.load(f)
+
+def _partes_recebidas(pasta):
+    return sorted(int(nome[:-3]) for nome in os.listdir(os.path.join(pasta, 'partes')) if nome.endswith('.ok'))
+
+def _copiar_stream(origem, destino, limite):
+    """Copia em blocos de 64 KB, sem carregar o conteúdo todo na memória; retorna (bytes, sha256)."""
+    digest = hashlib.sha256()
+    total = 0
+    while True:
+        bloco = origem.read(min(64 * 1024, limite - total + 1))
+        if not bloco:
+            break
+        total += len(bloco)
+        if total > limite:
+            break
+        destino.write(bloco)
+        digest.update(bloco)
+    return total, digest.hexdigest()
+
+def imagens_enviadas_validas():
+    """Nomes de imagens já montadas pelo upload em partes, enviados junto com o formulário.
+
+    Só aceita nomes que o próprio servidor emitiu para esta sessão em concluir_upload,
+    e cada nome vale uma vez só.
+    """
+    emitidos = session.get('uploads_emitidos', [])
+    nomes = []
+    for nome in request.form.getlist('imagens_enviadas'):
+        if nome in emitidos and nome not in nomes and \
+                os.path.isfile(os.path.join(pasta_uploads(), nome)):
+            nomes.append(nome)
+    if nomes:
+        session['uploads_emitidos'] = [nome for nome in emitidos if nome not in nomes]
+    return nomes
+
+@app.route('/upload/iniciar', methods=['POST'])
+@login_required
+def iniciar_upload():
+    dados = request.get_json(silent=True) or {}
+    nome = secure_filename(dados.get('nome') or '')
+    tamanho = dados.get('tamanho')
+    sha256 = (dados.get('sha256') or '').lower()
+
+    if not nome or not allowed_file(nome):
+        return jsonify({'erro': 'Tipo de arquivo não permitido.'}), 400
+    if not isinstance(tamanho, int) or not 0 < tamanho <= app.config['UPLOAD_TAMANHO_MAXIMO']:
+        return jsonify({'erro': 'Tamanho de arquivo inválido.'}), 400
+    if len(sha256) != 64:
+        return jsonify({'erro': 'Checksum SHA-256 obrigatório.'}), 400
+
+    upload_id = uuid.uuid4().hex
+    pasta = os.path.join(app.config['UPLOAD_PARTES_DIR'], upload_id)
+    os.makedirs(os.path.join(pasta, 'partes'))
+    tamanho_parte = app.config['UPLOAD_TAMANHO_PARTE']
+    meta = {
+        'nome': nome,
+        'tamanho': tamanho,
+        'sha256': sha256,
+        'tamanho_parte': tamanho_parte,
+        'total_partes': -(-tamanho // tamanho_parte),
+        'criado_em': datetime.now().isoformat()
+    }
+    with open(os.path.join(pasta, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    # Arquivo final já com o tamanho certo; cada parte é gravada na sua posição
+    with open(os.path.join(pasta, 'dados'), 'wb') as f:
+        f.truncate(tamanho)
+
+    return jsonify({'upload_id': upload_id, 'tamanho_parte': tamanho_parte, 'total_partes': meta['total_partes']}), 201
+
+@app.route('/upload/<upload_id>')
+@login_required
+def status_upload(upload_id):
+    pasta = _pasta_upload(upload_id)
+    meta = _ler_meta(pasta)
+    return jsonify({'upload_id': upload_id, 'total_partes': meta['total_partes'], 'recebidas': _partes_recebidas(pasta)})
+
+@app.route('/upload/<upload_id>/<int:indice>', methods=['PUT'])
+@login_required
+def enviar_parte(upload_id, indice):
+    pasta = _pasta_upload(upload_id)
+    meta = _ler_meta(pasta)
+    if indice >= meta['total_partes']:
+        return jsonify({'erro': 'Parte inexistente.'}), 400
+
+    inicio = indice * meta['tamanho_parte']
+    esperado = min(meta['tamanho_parte'], meta['tamanho'] - inicio)
+    with open(os.path.join(pasta, 'dados'), 'r+b') as destino:
+        destino.seek(inicio)
+        recebido, sha256 = _copiar_stream(request.stream, destino, esperado)
+
+    if recebido != esperado:
+        return jsonify({'erro': f'Parte com {recebido} bytes, esperado {esperado}.'}), 400
+    checksum = request.headers.get('X-Checksum-Sha256', '').lower()
+    if checksum and checksum != sha256:
+        return jsonify({'erro': 'Checksum da parte não confere.'}), 400
+
+    open(os.path.join(pasta, 'partes', f'{indice}.ok'), 'w').close()
+    return jsonify({'indice': indice, 'sha256': sha256})
+
+@app.route('/upload/<upload_id>/concluir', methods=['POST'])
+@login_required
+def concluir_upload(upload_id):
+    pasta = _pasta_upload(upload_id)
+    meta = _ler_meta(pasta)
+    faltando = sorted(set(range(meta['total_partes'])) - set(_partes_recebidas(pasta)))
+    if faltando:
+        return jsonify({'erro': 'Upload incompleto.', 'faltando': faltando}), 409
+
+    digest = hashlib.sha256()
+    with open(os.path.join(pasta, 'dados'), 'rb') as f:
+        for bloco in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(bloco)
+    if digest.hexdigest() != meta['sha256']:
+        shutil.rmtree(pasta, ignore_errors=True)
+        return jsonify({'erro': 'Checksum do arquivo não confere, envie novamente.'}), 400
+
+    # Nome único para nunca sobrescrever outra foto com o mesmo nome
+    arquivo = f"{uuid.uuid4().hex[:12]}_{meta['nome']}"
+    os.makedirs(pasta_uploads(), exist_ok=True)
+    os.replace(os.path.join(pasta, 'dados'), os.path.join(pasta_uploads(), arquivo))
+    shutil.rmtree(pasta, ignore_errors=True)
+
+    # Guarda os nomes emitidos; não usados viram órfãos para o reconciliar-uploads
+    session['uploads_emitidos'] = (session.get('uploads_emitidos', []) + [arquivo])[-50:]
+    return jsonify({'arquivo': arquivo})
+
+@app.errorhandler(413)
+def requisicao_muito_grande(erro):
+    limite_mb = app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)
+    if request.path.startswith('/upload/'):
+        return jsonify({'erro': f'Requisição maior que {limite_mb} MB.'}), 413
+    flash(f'As imagens enviadas passam de {limite_mb} MB. Envie menos fotos por vez.', 'danger')
+    return redirect(request.referrer or url_for('index'))
+
 # 🛍️ Listagem de produtos
 @app.route('/produtos')
 @login_required
@@ -276,9 +709,8 @@ def produtos():
     if disponivel in ['0', '1']:
         query = query.filter_by(disponivel=bool(int(disponivel)))
 
-    itens = query.order_by(Item.nome).all()
     agora = datetime.now()
-    return render_template('produtos.html', itens=itens, agora=agora)
+    return renderizar_lista('produtos.html', query, agora=agora)
 
 # ✏️ Edição de item
 @app.route('/editar/<int:item_id>', methods=['GET', 'POST'])
@@ -296,13 +728,16 @@ def editar_item(item_id):
         for imagem in novas_imagens:
             if imagem and imagem.filename and allowed_file(imagem.filename):
                 filename = secure_filename(imagem.filename)
-                os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-                caminho = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+                os.makedirs(pasta_uploads(), exist_ok=True)
+                caminho = os.path.join(pasta_uploads(), filename)
                 imagem.save(caminho)
 
                 nova_imagem = Imagem(caminho=filename, item_id=item.id)
                 db.session.add(nova_imagem)
 
+        for filename in imagens_enviadas_validas():
+            db.session.add(Imagem(caminho=filename, item_id=item.id))
+
         db.session.commit()
         flash('Item atualizado com sucesso!', 'success')
         return redirect(url_for('produtos'))
@@ -316,7 +751,7 @@ def excluir_imagem(imagem_id):
     imagem = Imagem.query.get_or_404(imagem_id)
     item_id = imagem.item_id
 
-    caminho = os.path.join(app.config['UPLOAD_FOLDER'], imagem.caminho)
+    caminho = os.path.join(pasta_uploads(), imagem.caminho)
     if os.path.exists(caminho):
         os.remove(caminho)
 
@@ -359,9 +794,9 @@ def categoria(categoria):
         flash('Categoria inválida.', 'danger')
         return redirect(url_for('catalogo'))
 
-    itens = Item.query.filter_by(categoria=categoria).order_by(Item.nome).all()
     agora = datetime.now()
-    return render_template('categoria.html', categoria=categoria, itens=itens, agora=agora)
+    query = Item.query.filter_by(categoria=categoria)
+    return renderizar_lista('categoria.html', query, categoria=categoria, agora=agora)
 
 # Página de detalhes do item
 from flask import render_template, request
@@ -418,8 +853,155 @@ def item(item_id):
         datas_livres=datas_livres
     )
 
+# 🚦 Limite de reservas (token bucket por IP e por telefone)
+def _consumir_token(balde, capacidade, periodo, agora):
+    """Recarrega o balde (tokens, atualizado) e tenta tirar um token.
+
+    Retorna (permitido, tokens, espera, expira); `expira` é quando o balde estará cheio de novo,
+    a partir daí ele pode ser descartado sem mudar nenhuma decisão.
+    """
+    taxa = capacidade / periodo
+    tokens, atualizado = balde if balde else (capacidade, agora)
+    tokens = min(capacidade, tokens + max(0, agora - atualizado) * taxa)
+    permitido = tokens >= 1
+    if permitido:
+        tokens -= 1
+    espera = 0 if permitido else (1 - tokens) / taxa
+    expira = agora + (capacidade - tokens) / taxa
+    return permitido, tokens, espera, expira
+
+
+class LimitadorMemoria:
+    """Baldes de tokens guardados na memória do worker."""
+
+    def __init__(self, max_chaves=10000):
+        self.lock = threading.Lock()
+        self.baldes = {}  # chave -> (tokens, atualizado, expira)
+        self.contadores = {}
+        self.max_chaves = max_chaves
+
+    def verificar(self, verificacoes):
+        """Consome um token de cada balde até a primeira recusa; retorna (tipo recusado, espera) ou (None, 0)."""
+        agora = time.monotonic()
+        with self.lock:
+            if len(self.baldes) > self.max_chaves:
+                # Remove só os baldes que já estariam cheios de novo, cada um pelo seu próprio período
+                self.baldes = {k: v for k, v in self.baldes.items() if v[2] > agora}
+            for tipo, chave, capacidade, periodo in verificacoes:
+                balde = self.baldes.get(chave)
+                permitido, tokens, espera, expira = _consumir_token(balde[:2] if balde else None, capacidade, periodo, agora)
+                self.baldes[chave] = (tokens, agora, expira)
+                if not permitido:
+                    self._incrementar(f'bloqueadas_{tipo}')
+                    return tipo, espera
+            self._incrementar('permitidas')
+        return None, 0
+
+    def _incrementar(self, nome):
+        self.contadores[nome] = self.contadores.get(nome, 0) + 1
+
+    def obter_contadores(self):
+        with self.lock:
+            return dict(self.contadores)
+
+
+class LimitadorSQLite:
+    """Baldes de tokens num arquivo SQLite separado, compartilhado entre processos."""
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        conn = self._conectar()
+        try:
+            # WAL fica gravado no arquivo; não precisa ser repetido a cada conexão
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS balde (chave TEXT PRIMARY KEY, tokens REAL, atualizado REAL, expira REAL)')
+            conn.execute('CREATE TABLE IF NOT EXISTS contador (nome TEXT PRIMARY KEY, valor INTEGER)')
+            colunas = {linha[1] for linha in conn.execute('PRAGMA table_info(balde)')}
+            if 'expira' not in colunas:
+                conn.execute('ALTER TABLE balde ADD COLUMN expira REAL')
+        finally:
+            conn.close()
+
+    def _conectar(self):
+        return sqlite3.connect(self.caminho, timeout=1, isolation_level=None)
+
+    def verificar(self, verificacoes):
+        """Mesmo contrato do LimitadorMemoria, numa única conexão e transação."""
+        agora = time.time()
+        resultado = (None, 0)
+        conn = self._conectar()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for tipo, chave, capacidade, periodo in verificacoes:
+                balde = conn.execute('SELECT tokens, atualizado FROM balde WHERE chave = ?', (chave,)).fetchone()
+                permitido, tokens, espera, expira = _consumir_token(balde, capacidade, periodo, agora)
+                conn.execute('INSERT OR REPLACE INTO balde (chave, tokens, atualizado, expira) VALUES (?, ?, ?, ?)',
+                             (chave, tokens, agora, expira))
+                if not permitido:
+                    resultado = (tipo, espera)
+                    break
+            conn.execute('INSERT INTO contador (nome, valor) VALUES (?, 1) '
+                         'ON CONFLICT(nome) DO UPDATE SET valor = valor + 1',
+                         (f'bloqueadas_{resultado[0]}' if resultado[0] else 'permitidas',))
+            # Cada balde sai pelo seu próprio horizonte de recarga
+            conn.execute('DELETE FROM balde WHERE expira IS NULL OR expira < ?', (agora,))
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+        return resultado
+
+    def obter_contadores(self):
+        conn = self._conectar()
+        try:
+            return dict(conn.execute('SELECT nome, valor FROM contador').fetchall())
+        finally:
+            conn.close()
+
+
+if app.config['RESERVA_LIMITE_BACKEND'] == 'sqlite':
+    limitador = LimitadorSQLite(app.config['RESERVA_LIMITE_ARQUIVO'])
+else:
+    limitador = LimitadorMemoria()
+
+
+def verificar_limite_reserva(ip, telefone):
+    """Retorna None se a reserva pode seguir, ou uma resposta 429 pronta."""
+    capacidade, periodo = app.config['RESERVA_LIMITE_IP']
+    verificacoes = [('ip', f'ip:{ip}', capacidade, periodo)]
+    telefone_normalizado = ''.join(c for c in (telefone or '') if c.isdigit())
+    if telefone_normalizado:
+        capacidade, periodo = app.config['RESERVA_LIMITE_TELEFONE']
+        verificacoes.append(('telefone', f'telefone:{telefone_normalizado}', capacidade, periodo))
+
+    try:
+        bloqueado, espera = limitador.verificar(verificacoes)
+    except sqlite3.OperationalError:
+        # Arquivo de limites travado/indisponível: não bloqueia o cliente por isso
+        return None
+    if bloqueado:
+        return ('Muitas tentativas de reserva. Tente novamente em instantes.', 429,
+                {'Retry-After': str(max(1, int(espera + 0.5)))})
+    return None
+
+
+@app.route('/monitoramento/limites')
+@login_required
+def monitoramento_limites():
+    return jsonify({
+        'backend': app.config['RESERVA_LIMITE_BACKEND'],
+        'limite_ip': app.config['RESERVA_LIMITE_IP'],
+        'limite_telefone': app.config['RESERVA_LIMITE_TELEFONE'],
+        'contadores': limitador.obter_contadores()
+    })
+
 @app.route('/reservar/<int:item_id>', methods=['POST'])
 def reservar(item_id):
+    # Rejeita rápido, antes de qualquer consulta ao banco
+    bloqueio = verificar_limite_reserva(request.remote_addr, request.form.get('telefone'))
+    if bloqueio:
+        return bloqueio
+
     item = Item.query.get_or_404(item_id)
 
     nome = request.form.get('nome')
@@ -569,6 +1151,7 @@ def fazer_pedido():
                 observacoes=observacoes
             )
             db.session.add(novo_pedido)
+            registrar_alteracao_disponibilidade(item_id, [data_evento])
             db.session.commit()
 
             log = LogPedido(
@@ -588,11 +1171,12 @@ def fazer_pedido():
             return redirect(url_for('fazer_pedido'))
 
     # Sempre renderiza o template no GET ou após erro no POST
-    pedidos = Pedido.query.all()
+    hoje = date.today()
+    # Só pedidos que ainda bloqueiam alguma data a partir de hoje (margem de 2 dias)
+    pedidos = Pedido.query.filter(Pedido.data_evento >= hoje - timedelta(days=2)).all()
     datas_bloqueadas = set()
     datas_livres = []
 
-    hoje = date.today()
     for i in range(0, 180):
         dia = hoje + timedelta(days=i)
         dia_str = dia.isoformat()
@@ -637,16 +1221,35 @@ def pedidos():
     elif status == 'cancelado':
         query = query.filter(Pedido.cancelado == True)
 
+    if request.args.get('historico') == '1':
+        return pedidos_com_historico(query, mes, page)
+
     pedidos_paginados = query.order_by(Pedido.data_evento.asc()).paginate(page=page, per_page=10)
     return render_template('pedidos.html', pedidos=pedidos_paginados.items, pagination=pedidos_paginados)
 
+def pedidos_com_historico(query, mes, page):
+    """Lista pedidos ativos e arquivados juntos, paginando sobre a união dos ids."""
+    arquivados = db.select(PedidoArquivado.id, PedidoArquivado.data_evento)
+    if mes:
+        arquivados = arquivados.where(db.extract('month', PedidoArquivado.data_evento) == mes)
+    ativos = query.with_entities(Pedido.id, Pedido.data_evento).statement
+    uniao = db.union_all(ativos, arquivados).order_by('data_evento', 'id')
+
+    paginacao = db.paginate(uniao, page=page, per_page=10)
+    ids = list(paginacao.items)
+    encontrados = {p.id: p for p in Pedido.query.filter(Pedido.id.in_(ids))}
+    encontrados.update({p.id: p for p in PedidoArquivado.query.filter(PedidoArquivado.id.in_(ids))})
+    pedidos = [encontrados[i] for i in ids if i in encontrados]
+    return render_template('pedidos.html', pedidos=pedidos, pagination=paginacao)
+
 @app.route('/pedido/<int:pedido_id>')
 @login_required
 def ver_pedido(pedido_id):
-    pedido = Pedido.query.get_or_404(pedido_id)
+    pedido = db.session.get(Pedido, pedido_id) or PedidoArquivado.query.get_or_404(pedido_id)
     cliente = Cliente.query.get(pedido.cliente_id)
     item = Item.query.get(pedido.item_id)
-    return render_template('ver_pedido.html', pedido=pedido, cliente=cliente, item=item)
+    return render_template('ver_pedido.html', pedido=pedido, cliente=cliente, item=item,
+                           arquivado=isinstance(pedido, PedidoArquivado))
 
 
 @app.route('/pedido/<int:pedido_id>/editar', methods=['GET', 'POST'])
@@ -673,6 +1276,11 @@ def editar_pedido(pedido_id):
             flash('Este item está reservado em datas próximas por outro pedido.', 'danger')
             return redirect(url_for('editar_pedido', pedido_id=pedido.id))
 
+        # Atualiza a agenda dos itens envolvidos (o antigo e o novo, se o item mudou)
+        if int(item_id) != pedido.item_id or data_evento != pedido.data_evento:
+            registrar_alteracao_disponibilidade(pedido.item_id, [pedido.data_evento])
+            registrar_alteracao_disponibilidade(int(item_id), [data_evento])
+
         # Atualiza os dados
         pedido.cliente_id = cliente_id
         pedido.item_id = item_id
@@ -687,12 +1295,15 @@ def editar_pedido(pedido_id):
         return redirect(url_for('ver_pedido', pedido_id=pedido.id))
 
     # Gera datas bloqueadas e livres
-    pedidos = Pedido.query.filter(Pedido.id != pedido.id).all()
+    hoje = date.today()
+    pedidos = Pedido.query.filter(
+        Pedido.id != pedido.id,
+        Pedido.data_evento >= hoje - timedelta(days=2)
+    ).all()
     datas_bloqueadas = set()
     datas_livres = []
     datas_livres_devolucao = []
 
-    hoje = date.today()
     for i in range(0, 180):
         dia = hoje + timedelta(days=i)
         dia_str = dia.isoformat()
@@ -736,40 +1347,547 @@ def editar_pedido(pedido_id):
         datas_livres_devolucao=datas_livres_devolucao or []
     )
 
+# 📅 Agenda de datas ocupadas por item, versionada
+def versao_disponibilidade(item_id):
+    versao = db.session.query(DisponibilidadeVersao.versao).filter_by(item_id=item_id).scalar()
+    return versao or 0
+
+def registrar_alteracao_disponibilidade(item_id, datas):
+    """Incrementa a versão da agenda do item e anota as datas tocadas (na transação atual)."""
+    atualizadas = db.session.execute(
+        db.update(DisponibilidadeVersao.__table__)
+        .where(DisponibilidadeVersao.item_id == item_id)
+        .values(versao=DisponibilidadeVersao.versao + 1)
+    ).rowcount
+    if not atualizadas:
+        db.session.execute(db.insert(DisponibilidadeVersao.__table__).values(item_id=item_id, versao=1))
+    versao = versao_disponibilidade(item_id)
+    for data in set(datas):
+        db.session.add(DisponibilidadeAlteracao(item_id=item_id, versao=versao, data=data))
+    return versao
+
+def _filtrar_janela(query, coluna, de, ate):
+    if de:
+        query = query.filter(coluna >= de)
+    if ate:
+        query = query.filter(coluna <= ate)
+    return query
+
 @app.route('/datas-indisponiveis/<int:item_id>')
 @login_required
 def datas_indisponiveis(item_id):
-    pedidos = Pedido.query.filter_by(item_id=item_id).all()
-    datas = [pedido.data_evento.strftime('%Y-%m-%d') for pedido in pedidos]
-    return jsonify(datas)
+    """Datas com pedido do item. Aceita ?de=/&ate= (AAAA-MM-DD) e ?since=<versao> para receber só as mudanças."""
+    try:
+        de = datetime.strptime(request.args['de'], '%Y-%m-%d').date() if request.args.get('de') else None
+        ate = datetime.strptime(request.args['ate'], '%Y-%m-%d').date() if request.args.get('ate') else None
+    except ValueError:
+        return jsonify({'erro': 'Data inválida. Use o formato AAAA-MM-DD.'}), 400
+    since = request.args.get('since', type=int)
+
+    # Só a versão é consultada antes de responder 304
+    versao = versao_disponibilidade(item_id)
+    etag = f"{g.get('loja') or 'principal'}-{item_id}-{versao}"
+    # Comparação fraca: a versão comprimida da resposta leva o mesmo ETag como W/"..."
+    if request.if_none_match.contains_weak(etag):
+        resposta = app.response_class(status=304)
+    else:
+        ocupadas = db.session.query(Pedido.data_evento).filter(Pedido.item_id == item_id).distinct()
+        if since is None:
+            # Formato original: lista simples de datas
+            datas = _filtrar_janela(ocupadas, Pedido.data_evento, de, ate).order_by(Pedido.data_evento)
+            resposta = jsonify([d.strftime('%Y-%m-%d') for (d,) in datas])
+        elif 0 <= since <= versao:
+            tocadas = {d for (d,) in _filtrar_janela(
+                db.session.query(DisponibilidadeAlteracao.data).filter(
+                    DisponibilidadeAlteracao.item_id == item_id,
+                    DisponibilidadeAlteracao.versao > since
+                ), DisponibilidadeAlteracao.data, de, ate).distinct()}
+            atuais = {d for (d,) in ocupadas.filter(Pedido.data_evento.in_(tocadas))} if tocadas else set()
+            resposta = jsonify({
+                'versao': versao,
+                'since': since,
+                'completo': False,
+                'adicionadas': [d.strftime('%Y-%m-%d') for d in sorted(tocadas & atuais)],
+                'removidas': [d.strftime('%Y-%m-%d') for d in sorted(tocadas - atuais)]
+            })
+        else:
+            # Versão desconhecida: devolve a agenda inteira para o cliente recomeçar
+            datas = _filtrar_janela(ocupadas, Pedido.data_evento, de, ate).order_by(Pedido.data_evento)
+            resposta = jsonify({'versao': versao, 'completo': True,
+                                'datas': [d.strftime('%Y-%m-%d') for (d,) in datas]})
+
+    resposta.set_etag(etag)
+    resposta.headers['X-Versao-Disponibilidade'] = str(versao)
+    resposta.headers['Cache-Control'] = 'private, no-cache'
+    return resposta
+
+
+# 📊 Painel consolidado de todas as lojas (somente leitura)
+_engines_leitura = {}
+
+def engine_leitura(loja):
+    """Engine que abre o banco da loja em modo somente leitura (mode=ro do SQLite)."""
+    if loja not in _engines_leitura:
+        caminho = engine_da_loja(loja).url.database
+        _engines_leitura[loja] = create_engine(f'sqlite:///file:{caminho}?mode=ro&uri=true')
+    return _engines_leitura[loja]
+
+def resumo_da_loja(loja):
+    hoje = date.today()
+    with Session(engine_leitura(loja)) as sessao:
+        contar = lambda modelo, *filtros: sessao.scalar(db.select(db.func.count()).select_from(modelo).where(*filtros))
+        return {
+            'loja': loja or 'principal',
+            'itens': contar(Item),
+            'disponiveis': contar(Item, Item.disponivel == True),
+            'clientes': contar(Cliente),
+            'pedidos_futuros': contar(Pedido, Pedido.data_evento >= hoje),
+            'retiradas_hoje': contar(Pedido, Pedido.data_retirada == hoje),
+            'reservas_pendentes': contar(Reserva, Reserva.confirmada == False, Reserva.cancelada == False,
+                                         Reserva.data_evento >= hoje),
+            'categorias': dict(sessao.execute(
+                db.select(Item.categoria, db.func.count(Item.id)).group_by(Item.categoria)
+            ).all())
+        }
+
+@app.route('/painel/lojas')
+@login_required
+def painel_lojas():
+    resumos = [resumo_da_loja(loja) for loja in todas_as_lojas()]
+    campos = ['itens', 'disponiveis', 'clientes', 'pedidos_futuros', 'retiradas_hoje', 'reservas_pendentes']
+    totais = {campo: sum(r[campo] for r in resumos) for campo in campos}
+    return render_template('painel_lojas.html', resumos=resumos, totais=totais)
+
+
+# 🗄️ Arquivamento de pedidos e reservas antigos
+def _mover_para_arquivo(modelo, modelo_arquivo, corte, lote):
+    """Move, em lotes, as linhas com data_evento anterior ao corte; retorna quantas foram movidas."""
+    colunas = [c.name for c in modelo.__table__.columns]
+    # O maior id fica na tabela principal: sem AUTOINCREMENT o SQLite reutilizaria o id
+    # e ele colidiria com o registro arquivado (logs e QR apontam para esse id)
+    maior_id = db.session.query(db.func.max(modelo.id)).scalar()
+    total = 0
+    while True:
+        ids = [linha[0] for linha in db.session.query(modelo.id).filter(
+            modelo.data_evento < corte, modelo.id != maior_id
+        ).limit(lote)]
+        if not ids:
+            break
+        if modelo is Pedido:
+            # Datas arquivadas saem da agenda dos itens
+            por_item = {}
+            for item_id, data_evento in db.session.query(Pedido.item_id, Pedido.data_evento).filter(Pedido.id.in_(ids)):
+                por_item.setdefault(item_id, set()).add(data_evento)
+            for item_id, datas in por_item.items():
+                registrar_alteracao_disponibilidade(item_id, datas)
+        db.session.execute(db.insert(modelo_arquivo.__table__).from_select(
+            colunas,
+            db.select(*[modelo.__table__.c[c] for c in colunas]).where(modelo.id.in_(ids))
+        ))
+        db.session.execute(db.delete(modelo.__table__).where(modelo.id.in_(ids)))
+        # Commit por lote para não segurar o lock de escrita do SQLite
+        db.session.commit()
+        total += len(ids)
+    return total
+
+def arquivar_historico(dias=None, otimizar=True, loja=None):
+    dias = app.config['ARQUIVO_DIAS'] if dias is None else dias
+    corte = date.today() - timedelta(days=dias)
+    lote = app.config['ARQUIVO_LOTE']
+    resultado = {
+        'corte': corte.isoformat(),
+        'pedidos': _mover_para_arquivo(Pedido, PedidoArquivado, corte, lote),
+        'reservas': _mover_para_arquivo(Reserva, ReservaArquivada, corte, lote)
+    }
+    if otimizar and (resultado['pedidos'] or resultado['reservas']):
+        # VACUUM não roda dentro de transação
+        with engine_da_loja(loja).connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.exec_driver_sql('VACUUM')
+            conn.exec_driver_sql('ANALYZE')
+    return resultado
+
+@app.cli.command('arquivar')
+@click.option('--dias', type=int, default=None, help='Arquiva eventos com mais de N dias (padrão: ARQUIVO_DIAS).')
+@click.option('--sem-vacuum', is_flag=True, help='Não roda VACUUM/ANALYZE depois de arquivar.')
+def arquivar(dias, sem_vacuum):
+    """Move pedidos e reservas antigos para as tabelas de arquivo (agendar via cron)."""
+    for loja in todas_as_lojas():
+        usar_loja(loja)
+        resultado = arquivar_historico(dias, otimizar=not sem_vacuum, loja=loja)
+        print(f"[{loja or 'principal'}] Eventos anteriores a {resultado['corte']}: "
+              f"{resultado['pedidos']} pedidos e {resultado['reservas']} reservas arquivados.")
+
+
+# 🧹 Reconciliação de arquivos enviados com o banco
+def _arquivos_protegidos():
+    """Imagens do site: lista fixa mais qualquer 'images/<nome>' citado nos templates e no CSS."""
+    protegidos = set(app.config['UPLOADS_PROTEGIDOS'])
+    for pasta in (os.path.join(app.root_path, 'templates'), os.path.join(app.root_path, 'static', 'css')):
+        for entrada in os.scandir(pasta):
+            if entrada.is_file():
+                with open(entrada.path, encoding='utf-8', errors='ignore') as f:
+                    protegidos.update(re.findall(r'images/([\w.\-]+)', f.read()))
+    return protegidos
+
+def _proximos_arquivos(pasta, cursor, limite):
+    """Os próximos `limite` arquivos (ordem alfabética) depois do cursor, sem listar a pasta inteira na memória."""
+    if not os.path.isdir(pasta):
+        return []
+    with os.scandir(pasta) as entradas:
+        return heapq.nsmallest(limite, (e for e in entradas if e.is_file() and e.name > cursor), key=lambda e: e.name)
+
+def _proximas_linhas(coluna_id, cursor, limite, *colunas):
+    return db.session.query(coluna_id, *colunas).filter(coluna_id > cursor).order_by(coluna_id).limit(limite).all()
+
+def reconciliar_uploads(apagar=False, limite=5000, lote=500, idade_minima=3600, estado=None):
+    """Compara static/images e static/qrcodes com o banco, retomando de onde a última execução parou."""
+    estado = estado if estado is not None else {}
+    relatorio = {'imagens_orfas': [], 'qrcodes_orfaos': [], 'imagens_sem_arquivo': [],
+                 'miniaturas_sem_arquivo': [], 'qrcodes_sem_arquivo': []}
+    agora = time.time()
+    protegidos = _arquivos_protegidos()
+    pasta_imagens = pasta_uploads()
+    pasta_qrcodes_loja = pasta_qrcodes()
+
+    # 1) Arquivos sem referência no banco
+    for chave, pasta in (('imagens', pasta_imagens), ('qrcodes', pasta_qrcodes_loja)):
+        entradas = _proximos_arquivos(pasta, estado.get(chave, ''), limite)
+        for i in range(0, len(entradas), lote):
+            # Arquivos recentes podem ser de um upload cujo registro ainda não foi gravado
+            candidatos = [e for e in entradas[i:i + lote]
+                          if e.name not in protegidos and agora - e.stat().st_mtime > idade_minima]
+            nomes = [e.name for e in candidatos]
+            if chave == 'imagens':
+                usados = {c for (c,) in db.session.query(Imagem.caminho).filter(Imagem.caminho.in_(nomes))}
+                usados |= {c for (c,) in db.session.query(Item.imagem_principal).filter(Item.imagem_principal.in_(nomes))}
+                orfaos = relatorio['imagens_orfas']
+            else:
+                caminhos = {caminho_qrcode(n[len('pedido_'):-len('.png')]): n for n in nomes}
+                usados = {caminhos[c] for (c,) in db.session.query(PedidoQR.qr_code_path).filter(PedidoQR.qr_code_path.in_(caminhos))}
+                orfaos = relatorio['qrcodes_orfaos']
+            for entrada in candidatos:
+                if entrada.name not in usados:
+                    orfaos.append(entrada.name)
+                    if apagar:
+                        os.remove(entrada.path)
+        # Lote incompleto: a pasta chegou ao fim e a próxima execução recomeça do início
+        estado[chave] = entradas[-1].name if len(entradas) == limite else ''
+
+    # 2) Registros apontando para arquivos que não existem mais
+    linhas = _proximas_linhas(Imagem.id, estado.get('imagem_id', 0), limite, Imagem.caminho)
+    for imagem_id, caminho in linhas:
+        if not os.path.exists(os.path.join(pasta_imagens, caminho)):
+            relatorio['imagens_sem_arquivo'].append(imagem_id)
+            if apagar:
+                db.session.execute(db.delete(Imagem.__table__).where(Imagem.id == imagem_id))
+    estado['imagem_id'] = linhas[-1][0] if len(linhas) == limite else 0
+
+    linhas = _proximas_linhas(Item.id, estado.get('item_id', 0), limite, Item.imagem_principal)
+    for item_id, principal in linhas:
+        if principal and principal not in protegidos and not os.path.exists(os.path.join(pasta_imagens, principal)):
+            relatorio['miniaturas_sem_arquivo'].append(item_id)
+            if apagar:
+                # Usa a primeira imagem que ainda existe, ou a imagem padrão
+                existentes = [c for (c,) in db.session.query(Imagem.caminho).filter(Imagem.item_id == item_id)
+                              if os.path.exists(os.path.join(pasta_imagens, c))]
+                db.session.execute(db.update(Item.__table__).where(Item.id == item_id)
+                                   .values(imagem_principal=existentes[0] if existentes else 'default.jpg'))
+    estado['item_id'] = linhas[-1][0] if len(linhas) == limite else 0
+
+    linhas = _proximas_linhas(PedidoQR.id, estado.get('pedidoqr_id', 0), limite, PedidoQR.qr_code_path)
+    for qr_id, caminho in linhas:
+        if not os.path.exists(os.path.join(app.root_path, caminho)):
+            relatorio['qrcodes_sem_arquivo'].append(qr_id)
+            if apagar:
+                # imprimir_pedido gera o QR de novo quando não encontra o registro
+                db.session.execute(db.delete(PedidoQR.__table__).where(PedidoQR.id == qr_id))
+    estado['pedidoqr_id'] = linhas[-1][0] if len(linhas) == limite else 0
+
+    if apagar:
+        db.session.commit()
+
+    # 3) Uploads em partes abandonados há mais de um dia (pasta única, vista só pelo banco principal)
+    pasta_partes = app.config['UPLOAD_PARTES_DIR']
+    if not g.get('loja') and os.path.isdir(pasta_partes):
+        with os.scandir(pasta_partes) as entradas:
+            for entrada in entradas:
+                if entrada.is_dir() and agora - entrada.stat().st_mtime > 24 * 3600:
+                    relatorio.setdefault('uploads_abandonados', []).append(entrada.name)
+                    if apagar:
+                        shutil.rmtree(entrada.path, ignore_errors=True)
+
+    return relatorio, estado
+
+@app.cli.command('reconciliar-uploads')
+@click.option('--apagar', is_flag=True, help='Apaga arquivos órfãos e corrige registros sem arquivo (padrão: só relata).')
+@click.option('--limite', type=int, default=5000, help='Máximo de arquivos/registros por tipo nesta execução.')
+@click.option('--reiniciar', is_flag=True, help='Ignora o progresso salvo e começa do início.')
+def reconciliar_uploads_cmd(apagar, limite, reiniciar):
+    """Relata (e opcionalmente limpa) imagens e QR codes sem vínculo com o banco."""
+    caminho_estado = os.path.join(app.instance_path, 'reconciliacao.json')
+    estado = {}
+    if os.path.exists(caminho_estado) and not reiniciar:
+        with open(caminho_estado) as f:
+            estado = json.load(f)
+
+    for loja in todas_as_lojas():
+        usar_loja(loja)
+        chave_loja = loja or 'principal'
+        relatorio, estado[chave_loja] = reconciliar_uploads(apagar=apagar, limite=limite, estado=estado.get(chave_loja, {}))
+        for chave, valores in relatorio.items():
+            print(f'[{chave_loja}] {chave}: {len(valores)}')
+            for valor in valores:
+                print(f'  {valor}')
+
+    with open(caminho_estado, 'w') as f:
+        json.dump(estado, f)
+    if not apagar:
+        print('Nada foi apagado. Use --apagar para limpar.')
+
+
+# 💾 Backup do banco com a API de backup online do SQLite
+def _verificar_integridade(caminho):
+    conn = sqlite3.connect(caminho)
+    try:
+        return conn.execute('PRAGMA integrity_check').fetchone()[0]
+    finally:
+        conn.close()
+
+def _prefixo_backup(loja=None):
+    return f'loja_{loja}' if loja else 'database'
+
+def ler_estado_backup(loja=None):
+    """Último backup pedido pelo painel (arquivo em disco, visível para todos os workers)."""
+    caminho = os.path.join(app.config['BACKUP_DIR'], _prefixo_backup(loja) + '.estado.json')
+    try:
+        with open(caminho) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _gravar_estado_backup(loja, **estado):
+    pasta = app.config['BACKUP_DIR']
+    os.makedirs(pasta, exist_ok=True)
+    caminho = os.path.join(pasta, _prefixo_backup(loja) + '.estado.json')
+    with open(caminho + '.tmp', 'w') as f:
+        json.dump({**estado, 'quando': datetime.now().strftime('%d/%m/%Y %H:%M:%S'), 'inicio': time.time()}, f)
+    os.replace(caminho + '.tmp', caminho)
+
+def _backup_em_segundo_plano(loja):
+    with app.app_context():
+        try:
+            resultado = fazer_backup(loja)
+        except Exception as e:
+            app.logger.exception('Falha no backup da loja %s', loja or 'principal')
+            _gravar_estado_backup(loja, situacao='erro', mensagem=str(e))
+        else:
+            _gravar_estado_backup(loja, situacao='ok', mensagem=f"{resultado['arquivo']} criado e verificado")
+
+def fazer_backup(loja=None):
+    """Copia o banco em passos curtos (escritores só esperam um passo), comprime, verifica e faz rodízio."""
+    origem_caminho = engine_da_loja(loja).url.database
+    pasta = app.config['BACKUP_DIR']
+    os.makedirs(pasta, exist_ok=True)
+    prefixo = _prefixo_backup(loja)
+    nome = f"{prefixo}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.db.gz"
+    destino_gz = os.path.join(pasta, nome)
+
+    with tempfile.TemporaryDirectory(dir=pasta) as temp:
+        copia = os.path.join(temp, 'copia.db')
+        origem = sqlite3.connect(origem_caminho, timeout=30)
+        destino = sqlite3.connect(copia)
+        try:
+            origem.backup(destino, pages=app.config['BACKUP_PAGINAS_POR_PASSO'], sleep=0.05)
+        finally:
+            destino.close()
+            origem.close()
+
+        # Qualquer falha (gzip quebrado, "file is not a database"...) descarta o .tmp
+        temporario = destino_gz + '.tmp'
+        try:
+            with open(copia, 'rb') as f, gzip.open(temporario, 'wb') as gz:
+                shutil.copyfileobj(f, gz, 1024 * 1024)
+
+            # Verifica o que seria restaurado: descomprime o snapshot e checa a integridade
+            restaurado = os.path.join(temp, 'restaurado.db')
+            with gzip.open(temporario, 'rb') as gz, open(restaurado, 'wb') as f:
+                shutil.copyfileobj(gz, f, 1024 * 1024)
+            integridade = _verificar_integridade(restaurado)
+            if integridade != 'ok':
+                raise RuntimeError(f'Backup corrompido, descartado: {integridade}')
+            os.replace(temporario, destino_gz)
+        finally:
+            if os.path.exists(temporario):
+                os.remove(temporario)
+
+    # Rodízio: os nomes têm data/hora, então a ordem alfabética é a cronológica.
+    # O padrão é exato para a loja "centro" não apagar os backups da "centro-sul".
+    padrao = re.compile(rf'{re.escape(prefixo)}-\d{{8}}-\d{{6}}\.db\.gz')
+    backups = sorted(n for n in os.listdir(pasta) if padrao.fullmatch(n))
+    removidos = backups[:-app.config['BACKUP_MANTER']] if app.config['BACKUP_MANTER'] else []
+    for antigo in removidos:
+        os.remove(os.path.join(pasta, antigo))
+
+    return {'arquivo': nome, 'tamanho': os.path.getsize(destino_gz), 'removidos': removidos}
+
+@app.cli.command('backup')
+def backup_cmd():
+    """Gera um snapshot comprimido e verificado do banco (pode rodar com o site no ar)."""
+    for loja in todas_as_lojas():
+        resultado = fazer_backup(loja)
+        print(f"Backup salvo: {resultado['arquivo']} ({resultado['tamanho'] / 1024:.1f} KB)")
+        for antigo in resultado['removidos']:
+            print(f'Removido pelo rodízio: {antigo}')
+
+@app.route('/admin/backup', methods=['POST'])
+@login_required
+def backup():
+    # Banco grande passaria do timeout do worker (30 s no gunicorn): roda numa thread
+    # e o resultado aparece no painel
+    estado = ler_estado_backup(g.loja)
+    if estado and estado['situacao'] == 'andamento' and \
+            time.time() - estado['inicio'] < app.config['BACKUP_TEMPO_MAXIMO']:
+        flash('Já existe um backup em andamento.', 'warning')
+        return redirect(url_for('painel'))
+
+    _gravar_estado_backup(g.loja, situacao='andamento', mensagem='Backup em andamento...')
+    threading.Thread(target=_backup_em_segundo_plano, args=(g.loja,), daemon=True).start()
+    flash('Backup iniciado; o resultado aparece no painel.', 'info')
+    return redirect(url_for('painel'))
 
 
 import qrcode
 import os
+from PIL import Image, ImageDraw, ImageFont
+
+def _salvar_qr(url, caminho):
+    qrcode.make(url).save(caminho)
+    return caminho
+
+def garantir_qrcodes(pedidos):
+    """Gera os QR codes que faltam e grava os PedidoQR de uma vez."""
+    faltando = [p for p in pedidos if p.qr is None]
+    if not faltando:
+        return
+    tarefas = [(url_for('ver_pedido', pedido_id=p.id, _external=True),
+                os.path.join(app.root_path, caminho_qrcode(p.id))) for p in faltando]
+    os.makedirs(os.path.dirname(tarefas[0][1]), exist_ok=True)
+
+    # Sequencial: o qrcode é Python puro (threads não ajudam) e um pool de processos
+    # faria fork do worker a cada requisição, ficando mais lento que gerar em sequência
+    for url, caminho in tarefas:
+        _salvar_qr(url, caminho)
+
+    for p in faltando:
+        p.qr = PedidoQR(pedido_id=p.id, qr_code_path=caminho_qrcode(p.id))
+    db.session.commit()
 
 @app.route('/pedido/<int:pedido_id>/imprimir')
 ###@login_required
 def imprimir_pedido(pedido_id):
-    pedido = Pedido.query.get_or_404(pedido_id)
-    cliente = Cliente.query.get(pedido.cliente_id)
-    item = Item.query.get(pedido.item_id)
-
-    # Verifica se já existe QR para o pedido
-    pedido_qr = PedidoQR.query.filter_by(pedido_id=pedido.id).first()
-    if not pedido_qr:
-        # Gera QR Code
-        url = url_for('ver_pedido', pedido_id=pedido.id, _external=True)
-        qr = qrcode.make(url)
-        qr_path = f'static/qrcodes/pedido_{pedido.id}.png'
-        os.makedirs(os.path.dirname(qr_path), exist_ok=True)
-        qr.save(qr_path)
-
-        # Salva no banco
-        pedido_qr = PedidoQR(pedido_id=pedido.id, qr_code_path=qr_path)
-        db.session.add(pedido_qr)
-        db.session.commit()
-
-    return render_template('imprimir_pedido.html', pedido=pedido, cliente=cliente, item=item, qr_path=pedido_qr.qr_code_path)
+    pedido = Pedido.query.options(
+        joinedload(Pedido.cliente), joinedload(Pedido.item), joinedload(Pedido.qr)
+    ).filter_by(id=pedido_id).first_or_404()
+    garantir_qrcodes([pedido])
+    return render_template('imprimir_pedido.html', pedidos=[pedido])
+
+def _fonte(tamanho):
+    # A fonte embutida do Pillow não tem acentos; usa uma TrueType do sistema quando houver
+    for nome in ('DejaVuSans.ttf', 'arial.ttf', 'Arial.ttf'):
+        try:
+            return ImageFont.truetype(nome, tamanho)
+        except OSError:
+            continue
+    return ImageFont.load_default(size=tamanho)
+
+def _pagina_pdf(pedido, logo):
+    """Recibo de um pedido como uma página A4 (150 dpi) para o PDF."""
+    pagina = Image.new('RGB', (1240, 1754), 'white')
+    desenho = ImageDraw.Draw(pagina)
+    titulo = _fonte(44)
+    secao = _fonte(32)
+    texto = _fonte(28)
+
+    if logo:
+        pagina.paste(logo, (90, 80), logo if logo.mode == 'RGBA' else None)
+    desenho.text((620, 130), 'Dados da Empresa', font=titulo, fill='black', anchor='mm')
+
+    formatar = lambda d: d.strftime('%d/%m/%Y') if d else '—'
+    blocos = [
+        (f'Protocolo: - {pedido.id}', []),
+        ('Dados do Cliente', [f'Nome: {pedido.cliente.nome}', f'Telefone: {pedido.cliente.telefone}']),
+        ('Item Reservado', [f'Nome: {pedido.item.nome}', f'Modelo: {pedido.item.modelo}']),
+        ('Datas', [f'Evento: {formatar(pedido.data_evento)}', f'Prova: {formatar(pedido.data_prova)}',
+                   f'Retirada: {formatar(pedido.data_retirada)}', f'Devolução: {formatar(pedido.data_devolucao)}']),
+        ('Outros', textwrap.wrap(f'Observações: {pedido.observacoes or "Nenhuma"}', 70)[:8])
+    ]
+    y = 280
+    for cabecalho, linhas in blocos:
+        desenho.text((90, y), cabecalho, font=secao, fill='black')
+        y += 46
+        if linhas:
+            desenho.line((90, y, 1150, y), fill='#cccccc', width=2)
+            y += 16
+        for linha in linhas:
+            desenho.text((110, y), linha, font=texto, fill='#333333')
+            y += 40
+        y += 30
+
+    desenho.text((90, 1380), 'Assinatura do Cliente:', font=texto, fill='black')
+    desenho.line((90, 1480, 650, 1480), fill='#333333', width=2)
+    desenho.text((90, 1495), 'Nome completo e data', font=texto, fill='#777777')
+
+    caminho_qr = os.path.join(app.root_path, pedido.qr.qr_code_path)
+    if os.path.exists(caminho_qr):
+        with Image.open(caminho_qr) as qr:
+            pagina.paste(qr.convert('RGB').resize((220, 220)), (930, 1340))
+
+    desenho.text((620, 1680), f"Impresso em {datetime.now().strftime('%d/%m/%Y %H:%M')}",
+                 font=texto, fill='#777777', anchor='mm')
+    return pagina
+
+@app.route('/pedidos/imprimir')
+@login_required
+def imprimir_pedidos():
+    """Recibos de vários pedidos numa página só: ?data=AAAA-MM-DD (retirada) ou ?ids=1,2,3; &formato=pdf para PDF."""
+    query = Pedido.query.options(joinedload(Pedido.cliente), joinedload(Pedido.item), joinedload(Pedido.qr))
+    ids = [int(i) for i in request.args.get('ids', '').split(',') if i.strip().isdigit()]
+    data_str = request.args.get('data')
+
+    if ids:
+        query = query.filter(Pedido.id.in_(ids))
+    elif data_str:
+        try:
+            dia = datetime.strptime(data_str, '%Y-%m-%d').date()
+        except ValueError:
+            flash('Data inválida. Use o formato correto (AAAA-MM-DD).', 'danger')
+            return redirect(url_for('pedidos'))
+        campos = {'retirada': Pedido.data_retirada, 'evento': Pedido.data_evento, 'prova': Pedido.data_prova}
+        query = query.filter(campos.get(request.args.get('campo'), Pedido.data_retirada) == dia)
+    else:
+        flash('Informe uma data ou a lista de pedidos para imprimir.', 'warning')
+        return redirect(url_for('pedidos'))
+
+    pedidos = query.order_by(Pedido.data_evento, Pedido.id).all()
+    if not pedidos:
+        flash('Nenhum pedido encontrado para impressão.', 'info')
+        return redirect(url_for('pedidos'))
+
+    garantir_qrcodes(pedidos)
+
+    if request.args.get('formato') == 'pdf':
+        logo = None
+        caminho_logo = os.path.join(app.config['UPLOAD_FOLDER'], 'logomaniquimf.png')
+        if os.path.exists(caminho_logo):
+            logo = Image.open(caminho_logo)
+            logo.thumbnail((400, 150))
+        paginas = [_pagina_pdf(p, logo) for p in pedidos]
+        arquivo = io.BytesIO()
+        paginas[0].save(arquivo, 'PDF', resolution=150, save_all=True, append_images=paginas[1:])
+        arquivo.seek(0)
+        return send_file(arquivo, mimetype='application/pdf', download_name=f'pedidos_{data_str or "selecionados"}.pdf')
+
+    return render_template('imprimir_pedido.html', pedidos=pedidos)
 
 @app.context_processor
 def inject_now():
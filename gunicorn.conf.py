@@ -0,0 +1,9 @@
+# Configuração do gunicorn (carregada automaticamente a partir da raiz do projeto)
+
+def post_worker_init(worker):
+    # Carrega os templates já compilados assim que o worker sobe,
+    # para que o primeiro visitante não pague o custo de compilação
+    from app import aquecer_templates
+
+    tempos = aquecer_templates()
+    worker.log.info('%d templates aquecidos em %.1f ms', len(tempos), sum(tempos.values()))
@@ -1,7 +1,23 @@
 from datetime import datetime
+from flask import g, has_app_context
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy import inspect
 
-db = SQLAlchemy()
+# Tabelas que ficam sempre no banco principal, compartilhadas por todas as lojas
+TABELAS_GLOBAIS = {'usuario'}
+
+class SessaoPorLoja(Session):
+    """Envia cada consulta para o banco da loja da requisição atual (g.loja)."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_app_context() and g.get('loja'):
+            tabela = inspect(mapper).local_table.name if mapper is not None else None
+            if tabela not in TABELAS_GLOBAIS:
+                return self._db.engines[g.loja]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+db = SQLAlchemy(session_options={'class_': SessaoPorLoja})
 
 class CategoriaDestaque(db.Model):
     __tablename__ = 'categoria_destaque'
@@ -54,6 +70,21 @@ class Reserva(db.Model):
     cancelada = db.Column(db.Boolean, default=False)
     data_criacao = db.Column(db.DateTime, default=datetime.utcnow)  # ← novo campo
 
+class ReservaArquivada(db.Model):
+    # Reservas com evento antigo, movidas pelo comando `flask arquivar`
+    __tablename__ = 'reserva_arquivada'
+
+    id = db.Column(db.Integer, primary_key=True)  # mesmo id da tabela reserva
+    nome = db.Column(db.String(100), nullable=False)
+    telefone = db.Column(db.String(20), nullable=False)
+    item_id = db.Column(db.Integer, db.ForeignKey('item.id'), nullable=False)
+    data_evento = db.Column(db.Date, nullable=False, index=True)
+    turno = db.Column(db.String(10), nullable=False)
+    confirmada = db.Column(db.Boolean, default=False)
+    cancelada = db.Column(db.Boolean, default=False)
+    data_criacao = db.Column(db.DateTime)
+    arquivado_em = db.Column(db.DateTime, default=datetime.utcnow)
+
 from flask_login import UserMixin
 
 class Usuario(db.Model, UserMixin):
@@ -91,6 +122,41 @@ class Pedido(db.Model):
     cliente = db.relationship('Cliente', backref='pedidos')
     item = db.relationship('Item', backref='pedidos')
 
+class DisponibilidadeVersao(db.Model):
+    # Contador de alterações da agenda de cada item (ETag do /datas-indisponiveis)
+    __tablename__ = 'disponibilidade_versao'
+
+    item_id = db.Column(db.Integer, db.ForeignKey('item.id'), primary_key=True)
+    versao = db.Column(db.Integer, nullable=False, default=0)
+
+class DisponibilidadeAlteracao(db.Model):
+    # Datas tocadas em cada versão, para o modo incremental (?since=)
+    __tablename__ = 'disponibilidade_alteracao'
+    __table_args__ = (db.Index('ix_disponibilidade_alteracao_item_versao', 'item_id', 'versao'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    item_id = db.Column(db.Integer, db.ForeignKey('item.id'), nullable=False)
+    versao = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.Date, nullable=False)
+
+class PedidoArquivado(db.Model):
+    # Pedidos com evento antigo, movidos pelo comando `flask arquivar`
+    __tablename__ = 'pedido_arquivado'
+
+    id = db.Column(db.Integer, primary_key=True)  # mesmo id da tabela pedido (logs e QR continuam válidos)
+    cliente_id = db.Column(db.Integer, db.ForeignKey('cliente.id'), nullable=False, index=True)
+    item_id = db.Column(db.Integer, db.ForeignKey('item.id'), nullable=False)
+    data_evento = db.Column(db.Date, nullable=False, index=True)
+    data_prova = db.Column(db.Date, nullable=True)
+    data_retirada = db.Column(db.Date, nullable=True)
+    data_devolucao = db.Column(db.Date, nullable=True)
+    observacoes = db.Column(db.Text, nullable=True)
+    criado_em = db.Column(db.DateTime)
+    arquivado_em = db.Column(db.DateTime, default=datetime.utcnow)
+
+    cliente = db.relationship('Cliente')
+    item = db.relationship('Item')
+
 
 class LogPedido(db.Model):
     id = db.Column(db.Integer, primary_key=True)
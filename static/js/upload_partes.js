@@ -0,0 +1,88 @@
+// Envio das imagens em partes (retomável), usado pelos formulários de item.
+// Se algo falhar (navegador sem crypto.subtle, rede, servidor), o formulário
+// é enviado do jeito tradicional, com os arquivos no próprio POST.
+(function () {
+  async function sha256Hex(buffer) {
+    const hash = await crypto.subtle.digest('SHA-256', buffer);
+    return Array.from(new Uint8Array(hash)).map(b => b.toString(16).padStart(2, '0')).join('');
+  }
+
+  async function enviarArquivo(base, arquivo, aoProgredir) {
+    const checksum = await sha256Hex(await arquivo.arrayBuffer());
+    const chave = 'upload:' + arquivo.name + ':' + arquivo.size + ':' + checksum;
+
+    // Retoma um upload interrompido do mesmo arquivo, se o servidor ainda o tiver
+    let upload = JSON.parse(localStorage.getItem(chave) || 'null');
+    let recebidas = [];
+    if (upload) {
+      const resp = await fetch(base + '/' + upload.upload_id);
+      if (resp.ok) {
+        recebidas = (await resp.json()).recebidas;
+      } else {
+        upload = null;
+      }
+    }
+    if (!upload) {
+      const resp = await fetch(base + '/iniciar', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({nome: arquivo.name, tamanho: arquivo.size, sha256: checksum})
+      });
+      if (!resp.ok) throw new Error((await resp.json()).erro);
+      upload = await resp.json();
+      localStorage.setItem(chave, JSON.stringify(upload));
+    }
+
+    for (let i = 0; i < upload.total_partes; i++) {
+      if (recebidas.includes(i)) continue;
+      const parte = await arquivo.slice(i * upload.tamanho_parte, (i + 1) * upload.tamanho_parte).arrayBuffer();
+      const resp = await fetch(base + '/' + upload.upload_id + '/' + i, {
+        method: 'PUT',
+        headers: {'Content-Type': 'application/octet-stream', 'X-Checksum-Sha256': await sha256Hex(parte)},
+        body: parte
+      });
+      if (!resp.ok) throw new Error('Falha ao enviar parte ' + i);
+      aoProgredir((i + 1) / upload.total_partes);
+    }
+
+    const resp = await fetch(base + '/' + upload.upload_id + '/concluir', {method: 'POST'});
+    localStorage.removeItem(chave);
+    if (!resp.ok) throw new Error((await resp.json()).erro);
+    return (await resp.json()).arquivo;
+  }
+
+  document.querySelectorAll('form[data-upload-partes]').forEach(function (form) {
+    const input = form.querySelector('input[type=file][name=imagens]');
+    const status = form.querySelector('[data-upload-status]');
+    // Endereço da API de upload (inclui o prefixo da loja, quando houver)
+    const base = form.dataset.uploadPartes || '/upload';
+    let enviando = false;
+
+    form.addEventListener('submit', async function (evento) {
+      if (enviando || !input.files.length || !window.crypto || !crypto.subtle) return;
+      evento.preventDefault();
+      enviando = true;
+      try {
+        const arquivos = Array.from(input.files);
+        for (let n = 0; n < arquivos.length; n++) {
+          const nome = await enviarArquivo(base, arquivos[n], function (fracao) {
+            if (status) status.textContent = 'Enviando imagem ' + (n + 1) + ' de ' + arquivos.length + ': ' + Math.round(fracao * 100) + '%';
+          });
+          const oculto = document.createElement('input');
+          oculto.type = 'hidden';
+          oculto.name = 'imagens_enviadas';
+          oculto.value = nome;
+          form.appendChild(oculto);
+        }
+        // As imagens já estão no servidor; o POST leva só os nomes
+        input.required = false;
+        input.disabled = true;
+      } catch (erro) {
+        // O envio normal leva todos os arquivos; os nomes já enviados duplicariam as imagens
+        form.querySelectorAll('input[type=hidden][name=imagens_enviadas]').forEach(function (oculto) { oculto.remove(); });
+        if (status) status.textContent = 'Envio em partes indisponível (' + erro.message + '), enviando normalmente...';
+      }
+      form.submit();
+    });
+  });
+})();